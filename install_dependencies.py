@@ -4,23 +4,21 @@
 import subprocess
 import sys
 import os
+import importlib.util
 
-def install_package(package):
-    """安装Python包"""
+def install_packages(packages):
+    """在一次pip调用中安装全部Python包"""
     try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+        # 单次解析统一处理共享依赖；多个pip进程并行写入同一site-packages会相互覆盖
+        subprocess.check_call([sys.executable, "-m", "pip", "install", *packages])
         return True
     except subprocess.CalledProcessError as e:
-        print(f"安装 {package} 失败: {e}")
+        print(f"安装 {' '.join(packages)} 失败: {e}")
         return False
 
 def check_package(package_name):
     """检查包是否已安装"""
-    try:
-        __import__(package_name)
-        return True
-    except ImportError:
-        return False
+    return importlib.util.find_spec(package_name) is not None
 
 def main():
     print("=" * 60)
@@ -29,7 +27,7 @@ def main():
     
     # 检查核心依赖
     core_deps = {
-        'requests': 'requests',
+        'httpx': 'httpx[socks,http2]',
         'PIL': 'pillow',
         'torch': 'torch',
         'numpy': 'numpy'
@@ -48,7 +46,6 @@ def main():
     print("\n🔍 检查图生文功能依赖...")
     vision_deps = {
         'openai': 'openai',
-        'httpx': 'httpx[socks]',
         'socksio': 'socksio'
     }
     
@@ -75,22 +72,10 @@ def main():
     
     if response in ['y', 'yes', '是']:
         print("\n🚀 开始安装依赖...")
-        success_count = 0
-        
-        for package in all_missing:
-            print(f"\n📦 安装 {package}...")
-            if install_package(package):
-                print(f"✅ {package} 安装成功")
-                success_count += 1
-            else:
-                print(f"❌ {package} 安装失败")
-        
-        print(f"\n📊 安装结果: {success_count}/{len(all_missing)} 个包安装成功")
-        
-        if success_count == len(all_missing):
+        if install_packages(all_missing):
             print("🎉 所有依赖安装完成！请重启ComfyUI。")
         else:
-            print("⚠️ 部分依赖安装失败，请手动安装或检查网络连接。")
+            print("⚠️ 依赖安装失败，请手动安装或检查网络连接。")
             print("\n手动安装命令:")
             for package in all_missing:
                 print(f"  pip install {package}")
@@ -0,0 +1,203 @@
+import importlib.util
+import json
+import os
+import ssl
+import sys
+from functools import lru_cache, wraps
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+_CFG_PATH = os.path.join(_DIR, 'modelscope_config.json')
+_TOKEN_PATH = os.path.join(_DIR, '.qwen_token')
+
+_CONFIG_CACHE = {}
+_last_saved_token = None
+
+# 安装了h2时文本与图生文节点共用的连接走HTTP/2，多个请求复用同一条TCP连接
+_HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+def _read_cached(path, parse):
+    # 按文件mtime缓存解析结果，文件未变化时直接返回内存中的数据
+    mtime = os.stat(path).st_mtime_ns
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'r', encoding='utf-8') as f:
+        data = parse(f)
+    _CONFIG_CACHE[path] = (mtime, data)
+    return data
+
+def load_config():
+    try:
+        return _read_cached(_CFG_PATH, json.load)
+    except:
+        return {
+            "default_model": "Qwen/Qwen-Image",
+            "timeout": 720,
+            "image_download_timeout": 30,
+            "default_prompt": "A beautiful landscape"
+        }
+
+def load_api_token(cfg=None):
+    try:
+        if cfg is None:
+            cfg = load_config()
+        return cfg.get("api_token", "").strip()
+    except Exception as e:
+        print(f"读取config.json中的token失败: {e}")
+        return ""
+
+@lru_cache(maxsize=1)
+def _shared_ssl_ctx():
+    return ssl.create_default_context()
+
+@lru_cache(maxsize=8)
+def get_client(api_token, pool_size=100, timeout=720):
+    # 按token与连接池配置缓存客户端，文本与图生文节点共享同一个实例，
+    # 复用SSL上下文与httpx连接池，避免每次调用都重新握手
+    from openai import OpenAI
+    import httpx
+    client_timeout = httpx.Timeout(connect=10.0, read=timeout, write=30.0, pool=30.0)
+    return OpenAI(
+        base_url='https://api-inference.modelscope.cn/v1',
+        api_key=api_token,
+        timeout=client_timeout,
+        http_client=httpx.Client(
+            verify=_shared_ssl_ctx(),
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max(1, pool_size // 2),
+                keepalive_expiry=60.0
+            ),
+            timeout=client_timeout,
+            follow_redirects=True
+        )
+    )
+
+def create_async_client(api_token, pool_size=100, timeout=720):
+    # AsyncClient的连接属于创建它的事件循环，而ComfyUI可能为每次执行新建循环，
+    # 因此每批请求新建一个并在结束时关闭，只共享SSL上下文
+    from openai import AsyncOpenAI
+    import httpx
+    client_timeout = httpx.Timeout(connect=10.0, read=timeout, write=30.0, pool=30.0)
+    return AsyncOpenAI(
+        base_url='https://api-inference.modelscope.cn/v1',
+        api_key=api_token,
+        timeout=client_timeout,
+        http_client=httpx.AsyncClient(
+            verify=_shared_ssl_ctx(),
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max(1, pool_size // 2),
+                keepalive_expiry=60.0
+            ),
+            timeout=client_timeout,
+            follow_redirects=True
+        )
+    )
+
+def config_mtime():
+    # 配置文件的mtime，用于判断INPUT_TYPES缓存是否失效
+    try:
+        return os.stat(_CFG_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def cached_input_types(func):
+    # 替代@classmethod用于INPUT_TYPES：按类缓存返回的dict，配置文件mtime变化时才重新构建
+    cache = {}
+
+    @wraps(func)
+    def wrapper(cls):
+        mtime = config_mtime()
+        cached = cache.get(cls)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        result = func(cls)
+        cache[cls] = (mtime, result)
+        return result
+    return classmethod(wrapper)
+
+def save_config(config: dict) -> bool:
+    tmp_path = _CFG_PATH + '.tmp'
+    try:
+        # 先写临时文件再原子替换，避免写入中断导致配置文件损坏
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, _CFG_PATH)
+        _CONFIG_CACHE[_CFG_PATH] = (os.stat(_CFG_PATH).st_mtime_ns, config)
+        return True
+    except Exception as e:
+        print(f"保存配置失败: {e}")
+        return False
+
+def api_token_changed(token):
+    # 只与内存中最近一次保存的token比较，节点执行时无需再读取配置文件
+    return token != _last_saved_token
+
+def save_api_token(token):
+    global _last_saved_token
+    if token == _last_saved_token:
+        return True
+    try:
+        cfg = dict(load_config())
+        cfg["api_token"] = token
+        if save_config(cfg):
+            _last_saved_token = token
+            return True
+        return False
+    except Exception as e:
+        print(f"保存token失败: {e}")
+        return False
+
+def _migrate_legacy_token():
+    # 旧版本把token单独存在.qwen_token中；配置里还没有token时迁移一次，之后只读配置文件
+    try:
+        if load_api_token() or not os.path.exists(_TOKEN_PATH):
+            return
+        with open(_TOKEN_PATH, 'r', encoding='utf-8') as f:
+            token = f.read().strip()
+        if token:
+            cfg = dict(load_config())
+            cfg["api_token"] = token
+            save_config(cfg)
+    except Exception as e:
+        print(f"迁移.qwen_token失败: {e}")
+
+_migrate_legacy_token()
+
+# 导入时记录配置中已保存的token，作为api_token_changed的比较基准
+_last_saved_token = load_config().get("api_token", "").strip() or None
+
+# 流式回显时每累计约这么多字符才写一次stdout
+_ECHO_CHUNK = 4096
+
+def _echo(text):
+    # stdout不可用（如pythonw）或控制台编码不支持时丢弃回显，不影响返回结果
+    try:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    except Exception:
+        pass
+
+def consume_stream(response, echo=False):
+    # 逐块收集流式响应，用列表拼接避免长输出时字符串反复复制
+    parts = []
+    echoed = 0
+    pending = 0
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            parts.append(content)
+            if echo:
+                pending += len(content)
+                if pending >= _ECHO_CHUNK:
+                    _echo("".join(parts[echoed:]))
+                    echoed = len(parts)
+                    pending = 0
+    if echo and echoed < len(parts):
+        _echo("".join(parts[echoed:]))
+    return "".join(parts)
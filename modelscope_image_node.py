@@ -1,104 +1,189 @@
-import requests
+import httpx
 import json
 import time
 import torch
 import numpy as np
 from PIL import Image
 from io import BytesIO
-import os
+import random
 import folder_paths
 import base64
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .modelscope_common import load_config, load_api_token, save_api_token, api_token_changed, cached_input_types, _HTTP2_AVAILABLE
 
-def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), 'modelscope_config.json')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {
-            "default_model": "Qwen/Qwen-Image",
-            "timeout": 720,
-            "image_download_timeout": 30,
-            "default_prompt": "A beautiful landscape"
-        }
+try:
+    import orjson
 
-def save_config(config: dict) -> bool:
-    config_path = os.path.join(os.path.dirname(__file__), 'modelscope_config.json')
-    try:
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"保存配置失败: {e}")
-        return False
+    def _dumps(data):
+        return orjson.dumps(data)
 
-def save_api_token(token):
-    token_path = os.path.join(os.path.dirname(__file__), '.qwen_token')
-    try:
-        with open(token_path, 'w', encoding='utf-8') as f:
-            f.write(token)
-    except Exception as e:
-        print(f"保存token失败(.qwen_token): {e}")
-    try:
-        cfg = load_config()
-        cfg["api_token"] = token
-        if save_config(cfg):
-            return True
-        return False
-    except Exception as e:
-        print(f"保存token失败(config.json): {e}")
-        return False
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(data):
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
 
-def load_api_token():
-    token_path = os.path.join(os.path.dirname(__file__), '.qwen_token')
-    try:
-        cfg = load_config()
-        token_from_cfg = cfg.get("api_token", "").strip()
-        if token_from_cfg:
-            return token_from_cfg
-    except Exception as e:
-        print(f"读取config.json中的token失败: {e}")
-    try:
-        if os.path.exists(token_path):
-            with open(token_path, 'r', encoding='utf-8') as f:
-                token = f.read().strip()
-                return token if token else ""
-        return ""
-    except Exception as e:
-        print(f"加载token失败: {e}")
-        return ""
+    _loads = json.loads
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _TJ = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # 未安装PyTurboJPEG或找不到libjpeg-turbo动态库时（TurboJPEG()抛出RuntimeError）使用PIL编码
+    _TJ = None
+
+_RNG = random.Random()
+
+# 生图请求体的固定键顺序，每次复制后填充，所有键都会在generate_image中赋值
+_PAYLOAD_TEMPLATE = {'model': None, 'prompt': None, 'size': None, 'steps': None, 'guidance': None, 'seed': None}
 
-def tensor_to_base64_url(image_tensor):
+# 任务轮询间隔：从0.5秒开始按1.5倍递增，最长5秒
+_POLL_INITIAL_DELAY = 0.5
+_POLL_MAX_DELAY = 5.0
+_POLL_BACKOFF = 1.5
+
+# 所有请求共用一个客户端，轮询与下载复用已建立的连接；
+# 安装了h2时使用HTTP/2，轮询请求的重复头部经HPACK压缩
+_HTTP_CLIENT = httpx.Client(
+    http2=_HTTP2_AVAILABLE,
+    limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    headers={'User-Agent': 'comfy-modelscope'},
+    follow_redirects=True
+)
+_WARMUP_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+def _warm_up_connection(url, timeout=10):
+    # 提前完成DNS解析和TLS握手，连接随后留在客户端的连接池中
     try:
-        if len(image_tensor.shape) == 4:
-            image_tensor = image_tensor.squeeze(0)
-        
-        if image_tensor.max() <= 1.0:
-            image_np = (image_tensor.cpu().numpy() * 255).astype(np.uint8)
-        else:
-            image_np = image_tensor.cpu().numpy().astype(np.uint8)
-        
-        pil_image = Image.fromarray(image_np)
-        
-        buffer = BytesIO()
-        pil_image.save(buffer, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return f"data:image/jpeg;base64,{img_base64}"
-        
-    except Exception as e:
-        print(f"图像转换失败: {e}")
-        raise Exception(f"图像格式转换失败: {str(e)}")
+        _HTTP_CLIENT.head(url, timeout=timeout).close()
+    except Exception:
+        pass
+
+def encode_tensor_to_jpeg_bytes(image_tensor):
+    if len(image_tensor.shape) == 4:
+        image_tensor = image_tensor[0]
+    # 缩放、截断与类型转换在设备上一次完成，再拷贝回CPU
+    if image_tensor.is_floating_point():
+        # 与原实现一致：最大值不超过1时按0-1处理，否则视为已是0-255
+        scale = 255 if image_tensor.max() <= 1.0 else 1
+        image_tensor = image_tensor.mul(scale).clamp_(0, 255)
+    # 已连续时contiguous()不复制；TurboJPEG要求按行连续的数据
+    image_np = image_tensor.to(torch.uint8).contiguous().cpu().numpy()
+    if _TJ is not None and image_np.ndim == 3 and image_np.shape[2] == 3:
+        # TurboJPEG按HWC的RGB数据编码，其他布局交给PIL处理
+        return _TJ.encode(image_np, quality=85,
+                          pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+    pil_image = Image.fromarray(image_np)
+    buffer = BytesIO()
+    pil_image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def pil_to_tensor(pil_image):
+    # uint8到float32的转换和缩放在torch中一次完成，不再生成float32的numpy中间数组
+    image_np = np.array(pil_image)
+    return torch.from_numpy(image_np).to(torch.float32).div_(255.0).unsqueeze(0)
+
+def json_body_with_image(payload, jpeg_bytes):
+    # base64字符不需要JSON转义，直接按字节拼接到请求体末尾，
+    # 避免序列化时逐字符扫描数MB的图像字符串并生成额外的副本
+    body = _dumps(payload)
+    separator = b', ' if payload else b''
+    return b''.join((
+        body[:-1], separator,
+        b'"image": "data:image/jpeg;base64,', base64.b64encode(jpeg_bytes), b'"}'
+    ))
+
+def download_image_tensor(url, timeout):
+    # 分块读入同一个缓冲区，不再额外生成完整的response.content
+    buffer = BytesIO()
+    with _HTTP_CLIENT.stream('GET', url, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise Exception(f"图片下载失败: {response.status_code}")
+        for chunk in response.iter_bytes(chunk_size=64 * 1024):
+            buffer.write(chunk)
+    buffer.seek(0)
+    pil_image = Image.open(buffer)
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return pil_to_tensor(pil_image)
+
+def _submit_and_wait(client, url, payload, headers, config, retry_payload=None):
+    """提交生成任务并轮询至完成，返回结果图片URL"""
+    # payload可以是dict或已序列化的bytes；返回400时若提供了retry_payload则重试一次
+    body = payload if isinstance(payload, bytes) else _dumps(payload)
+    submission_response = client.post(
+        url,
+        content=body,
+        headers=headers,
+        timeout=config.get("timeout", 60)
+    )
+    if submission_response.status_code == 400 and retry_payload is not None:
+        print("⚠️ 提交失败，尝试使用最小参数重试...")
+        submission_response = client.post(
+            url,
+            content=_dumps(retry_payload),
+            headers=headers,
+            timeout=config.get("timeout", 60)
+        )
+    if submission_response.status_code != 200:
+        raise Exception(f"API请求失败: {submission_response.status_code}, {submission_response.text}")
+    submission_json = _loads(submission_response.content)
+
+    if 'task_id' not in submission_json:
+        if 'images' in submission_json and len(submission_json['images']) > 0:
+            print(f"⬇️ 下载生成的图片...")
+            return submission_json['images'][0]['url']
+        raise Exception(f"未识别的API返回格式: {submission_json}")
+
+    task_id = submission_json['task_id']
+    print(f"🕒 已提交任务，任务ID: {task_id}，开始轮询...")
+    poll_start = time.time()
+    max_wait_seconds = max(60, config.get('timeout', 720))
+    task_url = f"https://api-inference.modelscope.cn/v1/tasks/{task_id}"
+    task_headers = {
+        'Authorization': headers['Authorization'],
+        'X-ModelScope-Task-Type': 'image_generation'
+    }
+    delay = _POLL_INITIAL_DELAY
+    last_status = None
+    while True:
+        task_resp = client.get(
+            task_url,
+            headers=task_headers,
+            timeout=config.get("image_download_timeout", 120)
+        )
+        if task_resp.status_code != 200:
+            raise Exception(f"任务查询失败: {task_resp.status_code}, {task_resp.text}")
+        task_data = _loads(task_resp.content)
+        status = task_data.get('task_status')
+        if status != last_status:
+            delay = _POLL_INITIAL_DELAY
+            last_status = status
+        if status == 'SUCCEED':
+            output_images = task_data.get('output_images') or []
+            if not output_images:
+                raise Exception("任务成功但未返回图片URL")
+            print("✅ 任务完成，开始下载图片...")
+            return output_images[0]
+        if status == 'FAILED':
+            errors = task_data.get('errors') or {}
+            if errors:
+                error_message = errors.get('message', '未知错误')
+                error_code = errors.get('code', '未知错误码')
+                raise Exception(f"任务失败: 错误码 {error_code}, 错误信息: {error_message}")
+            raise Exception(f"任务失败: {task_data}")
+        if time.time() - poll_start > max_wait_seconds:
+            raise Exception("任务轮询超时，请稍后重试或降低并发")
+        time.sleep(delay)
+        delay = min(delay * _POLL_BACKOFF, _POLL_MAX_DELAY)
 
 class ModelScopeImageNode:
     def __init__(self):
         pass
     
-    @classmethod
+    @cached_input_types
     def INPUT_TYPES(cls):
         config = load_config()
-        saved_token = load_api_token()
+        saved_token = load_api_token(config)
         return {
             "required": {
                 "prompt": ("STRING", {
@@ -158,21 +243,19 @@ class ModelScopeImageNode:
         config = load_config()
         if not api_token or api_token.strip() == "":
             raise Exception("请输入有效的API Token")
-        saved_token = load_api_token()
-        if api_token != saved_token:
+        if api_token_changed(api_token):
             if save_api_token(api_token):
                 print("✅ API Token已自动保存")
             else:
                 print("⚠️ API Token保存失败，但不影响当前使用")
         try:
             url = 'https://api-inference.modelscope.cn/v1/images/generations'
-            payload = {
-                'model': model,
-                'prompt': prompt,
-                'size': f"{width}x{height}",
-                'steps': steps,
-                'guidance': guidance
-            }
+            payload = _PAYLOAD_TEMPLATE.copy()
+            payload['model'] = model
+            payload['prompt'] = prompt
+            payload['size'] = f"{width}x{height}"
+            payload['steps'] = steps
+            payload['guidance'] = guidance
             if negative_prompt.strip():
                 payload['negative_prompt'] = negative_prompt
                 print(f"🚫 负向提示词: {negative_prompt}")
@@ -180,8 +263,7 @@ class ModelScopeImageNode:
                 payload['seed'] = seed
                 print(f"🎯 使用指定种子: {seed}")
             else:
-                import random
-                random_seed = random.randint(0, 2147483647)
+                random_seed = _RNG.randrange(0, 2147483648)
                 payload['seed'] = random_seed
                 print(f"🎲 使用随机种子: {random_seed}")
             print(f"📐 图像尺寸: {width}x{height}")
@@ -192,88 +274,28 @@ class ModelScopeImageNode:
                 'Content-Type': 'application/json',
                 'X-ModelScope-Async-Mode': 'true'
             }
-            submission_response = requests.post(
-                url, 
-                data=json.dumps(payload, ensure_ascii=False).encode('utf-8'), 
-                headers=headers,
-                timeout=config.get("timeout", 60)
-            )
-            if submission_response.status_code == 400:
-                print("⚠️ 提交失败，尝试使用最小参数重试...")
-                minimal_payload = {
-                    'model': model,
-                    'prompt': prompt
-                }
-                submission_response = requests.post(
-                    url,
-                    data=json.dumps(minimal_payload, ensure_ascii=False).encode('utf-8'),
-                    headers=headers,
-                    timeout=config.get("timeout", 60)
-                )
-            if submission_response.status_code != 200:
-                raise Exception(f"API请求失败: {submission_response.status_code}, {submission_response.text}")
-            submission_json = submission_response.json()
-            image_url = None
-            if 'task_id' in submission_json:
-                task_id = submission_json['task_id']
-                print(f"🕒 已提交任务，任务ID: {task_id}，开始轮询...")
-                poll_start = time.time()
-                max_wait_seconds = max(60, config.get('timeout', 720))
-                while True:
-                    task_resp = requests.get(
-                        f"https://api-inference.modelscope.cn/v1/tasks/{task_id}",
-                        headers={
-                            'Authorization': f'Bearer {api_token}',
-                            'X-ModelScope-Task-Type': 'image_generation'
-                        },
-                        timeout=config.get("image_download_timeout", 120)
-                    )
-                    if task_resp.status_code != 200:
-                        raise Exception(f"任务查询失败: {task_resp.status_code}, {task_resp.text}")
-                    task_data = task_resp.json()
-                    status = task_data.get('task_status')
-                    if status == 'SUCCEED':
-                        output_images = task_data.get('output_images') or []
-                        if not output_images:
-                            raise Exception("任务成功但未返回图片URL")
-                        image_url = output_images[0]
-                        print("✅ 任务完成，开始下载图片...")
-                        break
-                    if status == 'FAILED':
-                        raise Exception(f"任务失败: {task_data}")
-                    if time.time() - poll_start > max_wait_seconds:
-                        raise Exception("任务轮询超时，请稍后重试或降低并发")
-                    time.sleep(5)
-            elif 'images' in submission_json and len(submission_json['images']) > 0:
-                image_url = submission_json['images'][0]['url']
-                print(f"⬇️ 下载生成的图片...")
-            else:
-                raise Exception(f"未识别的API返回格式: {submission_json}")
-            img_response = requests.get(image_url, timeout=config.get("image_download_timeout", 30))
-            if img_response.status_code != 200:
-                raise Exception(f"图片下载失败: {img_response.status_code}")
-            pil_image = Image.open(BytesIO(img_response.content))
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-            image_np = np.array(pil_image).astype(np.float32) / 255.0
-            image_tensor = torch.from_numpy(image_np)[None,]
+            minimal_payload = {
+                'model': model,
+                'prompt': prompt
+            }
+            image_url = _submit_and_wait(_HTTP_CLIENT, url, payload, headers, config, retry_payload=minimal_payload)
+            image_tensor = download_image_tensor(image_url, config.get("image_download_timeout", 30))
             print(f"🎉 图片处理完成！")
             return (image_tensor,)
         except Exception as e:
             print(f"Qwen-Image API调用失败: {str(e)}")
             error_image = Image.new('RGB', (width, height), color='red')
-            error_np = np.array(error_image).astype(np.float32) / 255.0
-            error_tensor = torch.from_numpy(error_np)[None,]
+            error_tensor = pil_to_tensor(error_image)
             return (error_tensor,)
 
 class ModelScopeImageEditNode:
     def __init__(self):
         pass
 
-    @classmethod
+    @cached_input_types
     def INPUT_TYPES(cls):
         config = load_config()
-        saved_token = load_api_token()
+        saved_token = load_api_token(config)
         return {
             "required": {
                 "image": ("IMAGE",),
@@ -336,67 +358,50 @@ class ModelScopeImageEditNode:
         config = load_config()
         if not api_token or api_token.strip() == "":
             raise Exception("请输入有效的API Token")
-        saved_token = load_api_token()
-        if api_token != saved_token:
+        if api_token_changed(api_token):
             if save_api_token(api_token):
                 print("✅ API Token已自动保存")
             else:
                 print("⚠️ API Token保存失败，但不影响当前使用")
 
         try:
-            # 将图像转换为临时文件并上传获取URL
-            temp_img_path = None
+            # 图像只编码一次，上传与base64回退共用同一份JPEG数据
+            # 上传图像的同时在后台预热到ModelScope的连接，不等待预热结束；
+            # 提交请求时若握手尚未完成，连接池会另建连接
+            _WARMUP_EXECUTOR.submit(_warm_up_connection, 'https://api-inference.modelscope.cn')
+            jpeg_bytes = encode_tensor_to_jpeg_bytes(image)
             image_url = None
             try:
-                # 保存图像到临时文件
-                temp_img_path = os.path.join(tempfile.gettempdir(), f"qwen_edit_temp_{int(time.time())}.jpg")
-                if len(image.shape) == 4:
-                    img = image[0]
-                else:
-                    img = image
-                
-                i = 255. * img.cpu().numpy()
-                img_pil = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-                img_pil.save(temp_img_path)
-                print(f"✅ 图像已保存到临时文件: {temp_img_path}")
-                
                 # 上传图像到kefan.cn获取URL
                 upload_url = 'https://ai.kefan.cn/api/upload/local'
-                with open(temp_img_path, 'rb') as img_file:
-                    files = {'file': img_file}
-                    upload_response = requests.post(
-                        upload_url,
-                        files=files,
-                        timeout=30
-                    )
-                    if upload_response.status_code == 200:
-                        upload_data = upload_response.json()
-                        # 修复这里的判断逻辑，kefan.cn返回code=200表示成功
-                        if upload_data.get('success') == True and 'data' in upload_data:
-                            image_url = upload_data['data']
-                            print(f"✅ 图像已上传成功，获取URL: {image_url}")
-                        else:
-                            print(f"⚠️ 图像上传返回错误: {upload_response.text}")
+                files = {'file': ('img.jpg', jpeg_bytes, 'image/jpeg')}
+                upload_response = _HTTP_CLIENT.post(
+                    upload_url,
+                    files=files,
+                    timeout=30
+                )
+                if upload_response.status_code == 200:
+                    upload_data = _loads(upload_response.content)
+                    # 修复这里的判断逻辑，kefan.cn返回code=200表示成功
+                    if upload_data.get('success') == True and 'data' in upload_data:
+                        image_url = upload_data['data']
+                        print(f"✅ 图像已上传成功，获取URL: {image_url}")
                     else:
-                        print(f"⚠️ 图像上传失败: {upload_response.status_code}, {upload_response.text}")
+                        print(f"⚠️ 图像上传返回错误: {upload_response.text}")
+                else:
+                    print(f"⚠️ 图像上传失败: {upload_response.status_code}, {upload_response.text}")
             except Exception as e:
                 print(f"⚠️ 图像上传异常: {str(e)}")
             
-            # 如果上传失败，回退到base64
+            payload = {
+                'model': model,
+                'prompt': prompt
+            }
+            # 如果上传失败，回退到base64（在构造请求体时再拼接图像数据）
             if not image_url:
                 print("⚠️ 图像URL获取失败，回退到使用base64")
-                image_data = tensor_to_base64_url(image)
-                payload = {
-                    'model': model,
-                    'prompt': prompt,
-                    'image': image_data
-                }
             else:
-                payload = {
-                    'model': model,
-                    'prompt': prompt,
-                    'image_url': image_url
-                }
+                payload['image_url'] = image_url
             
             if negative_prompt.strip():
                 payload['negative_prompt'] = negative_prompt
@@ -430,78 +435,13 @@ class ModelScopeImageEditNode:
             print(f"✏️ 编辑提示: {prompt}")
             
             url = 'https://api-inference.modelscope.cn/v1/images/generations'
-            submission_response = requests.post(
-                url,
-                data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
-                headers=headers,
-                timeout=config.get("timeout", 60)
-            )
-            
-            if submission_response.status_code != 200:
-                raise Exception(f"API请求失败: {submission_response.status_code}, {submission_response.text}")
-                
-            submission_json = submission_response.json()
-            result_image_url = None
-            
-            if 'task_id' in submission_json:
-                task_id = submission_json['task_id']
-                print(f"🕒 已提交任务，任务ID: {task_id}，开始轮询...")
-                poll_start = time.time()
-                max_wait_seconds = max(60, config.get('timeout', 720))
-                
-                while True:
-                    task_resp = requests.get(
-                        f"https://api-inference.modelscope.cn/v1/tasks/{task_id}",
-                        headers={
-                            'Authorization': f'Bearer {api_token}',
-                            'X-ModelScope-Task-Type': 'image_generation'
-                        },
-                        timeout=config.get("image_download_timeout", 120)
-                    )
-                    
-                    if task_resp.status_code != 200:
-                        raise Exception(f"任务查询失败: {task_resp.status_code}, {task_resp.text}")
-                        
-                    task_data = task_resp.json()
-                    status = task_data.get('task_status')
-                    
-                    if status == 'SUCCEED':
-                        output_images = task_data.get('output_images') or []
-                        if not output_images:
-                            raise Exception("任务成功但未返回图片URL")
-                        result_image_url = output_images[0]
-                        print("✅ 任务完成，开始下载编辑后的图片...")
-                        break
-                        
-                    if status == 'FAILED':
-                        error_message = task_data.get('errors', {}).get('message', '未知错误')
-                        error_code = task_data.get('errors', {}).get('code', '未知错误码')
-                        raise Exception(f"任务失败: 错误码 {error_code}, 错误信息: {error_message}")
-                        
-                    if time.time() - poll_start > max_wait_seconds:
-                        raise Exception("任务轮询超时，请稍后重试或降低并发")
-                        
-                    time.sleep(5)
+            if image_url:
+                body = _dumps(payload)
             else:
-                raise Exception(f"未识别的API返回格式: {submission_json}")
-                
-            img_response = requests.get(result_image_url, timeout=config.get("image_download_timeout", 30))
-            if img_response.status_code != 200:
-                raise Exception(f"图片下载失败: {img_response.status_code}")
+                body = json_body_with_image(payload, jpeg_bytes)
+            result_image_url = _submit_and_wait(_HTTP_CLIENT, url, body, headers, config)
                 
-            pil_image = Image.open(BytesIO(img_response.content))
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-                
-            image_np = np.array(pil_image).astype(np.float32) / 255.0
-            image_tensor = torch.from_numpy(image_np)[None,]
-            
-            # 清理临时文件
-            if temp_img_path and os.path.exists(temp_img_path):
-                try:
-                    os.remove(temp_img_path)
-                except:
-                    pass
+            image_tensor = download_image_tensor(result_image_url, config.get("image_download_timeout", 30))
             
             print(f"🎉 图片编辑完成！")
             return (image_tensor,)
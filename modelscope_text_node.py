@@ -1,7 +1,5 @@
-import requests
-import json
-import time
-import os
+import asyncio
+from .modelscope_common import load_config, load_api_token, save_api_token, api_token_changed, cached_input_types, get_client, create_async_client, consume_stream
 
 try:
     from openai import OpenAI
@@ -12,58 +10,11 @@ except ImportError:
     OPENAI_AVAILABLE = False
     OpenAI = None
 
-def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), 'modelscope_config.json')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {
-            "default_model": "Qwen/Qwen-Image",
-            "timeout": 720,
-            "image_download_timeout": 30,
-            "default_prompt": "A beautiful landscape"
-        }
-
-def load_api_token():
-    token_path = os.path.join(os.path.dirname(__file__), '.qwen_token')
-    try:
-        cfg = load_config()
-        token_from_cfg = cfg.get("api_token", "").strip()
-        if token_from_cfg:
-            return token_from_cfg
-    except Exception as e:
-        print(f"读取config.json中的token失败: {e}")
-    try:
-        if os.path.exists(token_path):
-            with open(token_path, 'r', encoding='utf-8') as f:
-                token = f.read().strip()
-                return token if token else ""
-        return ""
-    except Exception as e:
-        print(f"加载token失败: {e}")
-        return ""
-
-def save_api_token(token):
-    token_path = os.path.join(os.path.dirname(__file__), '.qwen_token')
-    try:
-        with open(token_path, 'w', encoding='utf-8') as f:
-            f.write(token)
-        cfg = load_config()
-        cfg["api_token"] = token
-        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(cfg, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"保存token失败: {e}")
-        return False
-
 class QwenTextNode:
     def __init__(self):
         pass
 
-    @classmethod
+    @cached_input_types
     def INPUT_TYPES(cls):
         if not OPENAI_AVAILABLE:
             return {
@@ -75,7 +26,7 @@ class QwenTextNode:
                 }
             }
         config = load_config()
-        saved_token = load_api_token()
+        saved_token = load_api_token(config)
         return {
             "required": {
                 "user_prompt": ("STRING", {
@@ -122,30 +73,28 @@ class QwenTextNode:
             return ("请先安装openai库: pip install openai",)
         
         config = load_config()
+        verbose = config.get('verbose', False)
         
         if not api_token or api_token.strip() == "":
             raise Exception("请输入有效的API Token")
         
-        saved_token = load_api_token()
-        if api_token != saved_token:
+        if api_token_changed(api_token):
             if save_api_token(api_token):
                 print("✅ API Token已自动保存")
             else:
                 print("⚠️ API Token保存失败，但不影响当前使用")
         
         try:
-            print(f"💬 开始文本生成...")
-            print(f"🤖 模型: {model}")
-            print(f"📝 用户提示: {user_prompt[:50]}...")
-            print(f"⚙️ 系统提示: {system_prompt[:50]}...")
-            print(f"🌡️ 温度: {temperature}")
-            print(f"📊 最大tokens: {max_tokens}")
-            print(f"⚡ 流式输出: {stream}")
+            if verbose:
+                print(f"💬 开始文本生成...")
+                print(f"🤖 模型: {model}")
+                print(f"📝 用户提示: {user_prompt[:50]}...")
+                print(f"⚙️ 系统提示: {system_prompt[:50]}...")
+                print(f"🌡️ 温度: {temperature}")
+                print(f"📊 最大tokens: {max_tokens}")
+                print(f"⚡ 流式输出: {stream}")
             
-            client = OpenAI(
-                base_url='https://api-inference.modelscope.cn/v1',
-                api_key=api_token
-            )
+            client = get_client(api_token, config.get('pool_size', 100), config.get('timeout', 720))
             
             messages = [
                 {
@@ -158,7 +107,8 @@ class QwenTextNode:
                 }
             ]
             
-            print(f"🚀 发送API请求...")
+            if verbose:
+                print(f"🚀 发送API请求...")
             
             response = client.chat.completions.create(
                 model=model,
@@ -169,22 +119,20 @@ class QwenTextNode:
             )
             
             if stream:
-                print("📡 接收流式响应...")
-                full_response = ""
-                for chunk in response:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_response += content
-                        print(content, end='', flush=True)
+                if verbose:
+                    print("📡 接收流式响应...")
+                full_response = consume_stream(response, echo=verbose)
                 
-                print(f"\n✅ 流式生成完成!")
-                print(f"📄 总长度: {len(full_response)} 字符")
+                if verbose:
+                    print(f"\n✅ 流式生成完成!")
+                    print(f"📄 总长度: {len(full_response)} 字符")
                 return (full_response,)
             else:
                 result = response.choices[0].message.content
-                print(f"✅ 文本生成完成!")
-                print(f"📄 结果长度: {len(result)} 字符")
-                print(f"📝 结果预览: {result[:100]}...")
+                if verbose:
+                    print(f"✅ 文本生成完成!")
+                    print(f"📄 结果长度: {len(result)} 字符")
+                    print(f"📝 结果预览: {result[:100]}...")
                 return (result,)
             
         except Exception as e:
@@ -192,14 +140,127 @@ class QwenTextNode:
             print(f"❌ {error_msg}")
             return (error_msg,)
 
+async def _batch_generate(api_token, prompts, system_prompt, model, max_tokens, temperature, config):
+    # 所有提示词并发提交，用信号量限制同时进行的请求数，避免耗尽连接池
+    semaphore = asyncio.Semaphore(config.get('max_concurrency', 16))
+    client = create_async_client(api_token, config.get('pool_size', 100), config.get('timeout', 720))
+
+    async def generate_one(prompt):
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {'role': 'system', 'content': system_prompt},
+                    {'role': 'user', 'content': prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=False
+            )
+            return response.choices[0].message.content
+
+    try:
+        return await asyncio.gather(*(generate_one(p) for p in prompts), return_exceptions=True)
+    finally:
+        await client.close()
+
+class QwenTextBatchNode:
+    def __init__(self):
+        pass
+
+    @cached_input_types
+    def INPUT_TYPES(cls):
+        config = load_config()
+        saved_token = load_api_token(config)
+        return {
+            "required": {
+                "prompts": ("STRING", {
+                    "multiline": True,
+                    "default": config.get("default_user_prompt", "你好")
+                }),
+                "api_token": ("STRING", {
+                    "default": saved_token,
+                    "placeholder": "请输入您的魔搭API Token"
+                }),
+            },
+            "optional": {
+                "system_prompt": ("STRING", {
+                    "multiline": True,
+                    "default": config.get("default_system_prompt", "You are a helpful assistant.")
+                }),
+                "model": ("STRING", {
+                    "default": config.get("default_text_model", "Qwen/Qwen3-Coder-480B-A35B-Instruct")
+                }),
+                "max_tokens": ("INT", {
+                    "default": 2000,
+                    "min": 100,
+                    "max": 8000
+                }),
+                "temperature": ("FLOAT", {
+                    "default": 0.7,
+                    "min": 0.1,
+                    "max": 2.0,
+                    "step": 0.1
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("responses",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "batch_generate"
+    CATEGORY = "ModelScopeAPI"
+
+    async def batch_generate(self, prompts="", api_token="", system_prompt="You are a helpful assistant.", model="Qwen/Qwen3-Coder-480B-A35B-Instruct", max_tokens=2000, temperature=0.7):
+        config = load_config()
+
+        if not api_token or api_token.strip() == "":
+            raise Exception("请输入有效的API Token")
+
+        if api_token_changed(api_token):
+            if save_api_token(api_token):
+                print("✅ API Token已自动保存")
+            else:
+                print("⚠️ API Token保存失败，但不影响当前使用")
+
+        # 每行一个提示词
+        prompt_list = [line.strip() for line in prompts.splitlines() if line.strip()]
+        if not prompt_list:
+            return ([],)
+
+        if config.get('verbose', False):
+            print(f"💬 开始批量文本生成，共 {len(prompt_list)} 条提示词...")
+
+        # ComfyUI在自身的事件循环中执行节点，协程FUNCTION会被直接await
+        try:
+            results = await _batch_generate(
+                api_token, prompt_list, system_prompt, model, max_tokens, temperature, config
+            )
+        except Exception as e:
+            error_msg = f"文本生成失败: {str(e)}"
+            print(f"❌ {error_msg}")
+            return ([error_msg] * len(prompt_list),)
+
+        responses = []
+        for result in results:
+            if isinstance(result, Exception):
+                error_msg = f"文本生成失败: {str(result)}"
+                print(f"❌ {error_msg}")
+                responses.append(error_msg)
+            else:
+                responses.append(result)
+        return (responses,)
+
 if OPENAI_AVAILABLE:
-NODE_CLASS_MAPPINGS = {
-    "ModelScopeTextNode": ModelScopeTextNode
-}
- 
-NODE_DISPLAY_NAME_MAPPINGS = {
-    "ModelScopeTextNode": "ModelScope-Text 文本生成节点"
-}
+    NODE_CLASS_MAPPINGS = {
+        "ModelScopeTextNode": QwenTextNode,
+        "ModelScopeTextBatchNode": QwenTextBatchNode
+    }
+
+    NODE_DISPLAY_NAME_MAPPINGS = {
+        "ModelScopeTextNode": "ModelScope-Text 文本生成节点",
+        "ModelScopeTextBatchNode": "ModelScope-Text 批量文本生成节点"
+    }
 else:
     class OpenAINotInstalledNode:
         @classmethod
@@ -222,9 +283,11 @@ else:
             return ("请先安装openai库才能使用文本生成功能: " + install_command,)
     
     NODE_CLASS_MAPPINGS = {
-        "QwenTextNode": OpenAINotInstalledNode
+        "QwenTextNode": OpenAINotInstalledNode,
+        "QwenTextBatchNode": OpenAINotInstalledNode
     }
 
     NODE_DISPLAY_NAME_MAPPINGS = {
-        "QwenTextNode": "Qwen-Text 文本生成节点 (需要安装openai)"
+        "QwenTextNode": "Qwen-Text 文本生成节点 (需要安装openai)",
+        "QwenTextBatchNode": "Qwen-Text 批量文本生成节点 (需要安装openai)"
     }
\ No newline at end of file
@@ -1,13 +1,4 @@
-import requests
-import json
-import time
-import torch
-import numpy as np
-from PIL import Image
-from io import BytesIO
-import os
-import base64
-import tempfile
+from .modelscope_common import load_config, load_api_token, save_api_token, api_token_changed, cached_input_types, get_client, consume_stream
 
 try:
     from openai import OpenAI
@@ -18,70 +9,40 @@ except ImportError:
     OPENAI_AVAILABLE = False
     OpenAI = None
 
-def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), 'modelscope_config.json')
+def tensor_to_base64_url(image_tensor, max_edge=None, quality=75):
+    # 图像相关依赖延迟到首次转换时导入，节点未被使用时不增加ComfyUI启动开销
+    import base64
+    from io import BytesIO
+    import torch
+    from PIL import Image
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {
-            "default_model": "Qwen/Qwen-Image",
-            "timeout": 720,
-            "image_download_timeout": 30,
-            "default_prompt": "A beautiful landscape"
-        }
-
-def load_api_token():
-    token_path = os.path.join(os.path.dirname(__file__), '.qwen_token')
-    try:
-        cfg = load_config()
-        token_from_cfg = cfg.get("api_token", "").strip()
-        if token_from_cfg:
-            return token_from_cfg
-    except Exception as e:
-        print(f"读取config.json中的token失败: {e}")
-    try:
-        if os.path.exists(token_path):
-            with open(token_path, 'r', encoding='utf-8') as f:
-                token = f.read().strip()
-                return token if token else ""
-        return ""
-    except Exception as e:
-        print(f"加载token失败: {e}")
-        return ""
-
-def save_api_token(token):
-    token_path = os.path.join(os.path.dirname(__file__), '.qwen_token')
-    try:
-        with open(token_path, 'w', encoding='utf-8') as f:
-            f.write(token)
-        cfg = load_config()
-        cfg["api_token"] = token
-        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(cfg, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"保存token失败: {e}")
-        return False
-
-def tensor_to_base64_url(image_tensor):
-    try:
-        if len(image_tensor.shape) == 4:
-            image_tensor = image_tensor.squeeze(0)
-        
-        if image_tensor.max() <= 1.0:
-            image_np = (image_tensor.cpu().numpy() * 255).astype(np.uint8)
-        else:
-            image_np = image_tensor.cpu().numpy().astype(np.uint8)
+        t = image_tensor.detach()
+        if t.dim() == 4:
+            t = t[0]
+        # 缩放、截断与类型转换在设备上一次完成，只把uint8数据拷贝回CPU
+        if t.is_floating_point():
+            # 最大值大于1的浮点输入视为0-255，不再乘255
+            scale = 255 if t.max() <= 1.0 else 1
+            t = t.mul(scale).clamp_(0, 255)
+        image_np = t.to(torch.uint8).contiguous().cpu().numpy()
         
         pil_image = Image.fromarray(image_np)
         
+        # 视觉模型按长边约1280像素处理输入，过大的图像先缩小以减少上传数据量
+        width, height = pil_image.size
+        longest = max(width, height)
+        if max_edge and longest > max_edge:
+            scale = max_edge / longest
+            resample = Image.LANCZOS if scale > 0.5 else Image.BILINEAR
+            pil_image = pil_image.resize((max(1, int(width * scale)), max(1, int(height * scale))), resample)
+        
         buffer = BytesIO()
-        pil_image.save(buffer, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # 视觉模型对q75与q85几乎没有差别，4:2:0色度抽样可进一步减小上传体积
+        pil_image.save(buffer, format='JPEG', quality=quality, optimize=False, progressive=False, subsampling=2)
+        # getbuffer直接引用缓冲区内容；base64只含ASCII字符，拼好前缀后一次解码
+        data_url = b"data:image/jpeg;base64," + base64.b64encode(buffer.getbuffer())
         
-        return f"data:image/jpeg;base64,{img_base64}"
+        return data_url.decode('ascii')
         
     except Exception as e:
         print(f"图像转换失败: {e}")
@@ -91,7 +52,7 @@ class QwenVisionNode:
     def __init__(self):
         pass
 
-    @classmethod
+    @cached_input_types
     def INPUT_TYPES(cls):
         if not OPENAI_AVAILABLE:
             return {
@@ -103,7 +64,7 @@ class QwenVisionNode:
                 }
             }
         config = load_config()
-        saved_token = load_api_token()
+        saved_token = load_api_token(config)
         return {
             "required": {
                 "image": ("IMAGE",),
@@ -144,29 +105,28 @@ class QwenVisionNode:
             return ("请先安装openai库: pip install openai",)
         
         config = load_config()
+        verbose = config.get('verbose', False)
         
         if not api_token or api_token.strip() == "":
             raise Exception("请输入有效的API Token")
         
-        saved_token = load_api_token()
-        if api_token != saved_token:
+        if api_token_changed(api_token):
             if save_api_token(api_token):
                 print("✅ API Token已自动保存")
             else:
                 print("⚠️ API Token保存失败，但不影响当前使用")
         
         try:
-            print(f"🔍 开始分析图像...")
-            print(f"📝 提示词: {prompt}")
-            print(f"🤖 模型: {model}")
+            if verbose:
+                print(f"🔍 开始分析图像...")
+                print(f"📝 提示词: {prompt}")
+                print(f"🤖 模型: {model}")
             
-            image_url = tensor_to_base64_url(image)
-            print(f"🖼️ 图像已转换为base64格式")
+            image_url = tensor_to_base64_url(image, config.get('vision_max_edge', 1280), config.get('jpeg_quality', 75))
+            if verbose:
+                print(f"🖼️ 图像已转换为base64格式")
             
-            client = OpenAI(
-                base_url='https://api-inference.modelscope.cn/v1',
-                api_key=api_token
-            )
+            client = get_client(api_token, config.get('pool_size', 100), config.get('timeout', 720))
             
             messages = [{
                 'role': 'user',
@@ -181,19 +141,21 @@ class QwenVisionNode:
                 }],
             }]
             
-            print(f"🚀 发送API请求...")
+            if verbose:
+                print(f"🚀 发送API请求...")
             
             response = client.chat.completions.create(
                 model=model,
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                stream=False
+                stream=True
             )
             
-            description = response.choices[0].message.content
-            print(f"✅ 分析完成!")
-            print(f"📄 结果: {description[:100]}...")
+            description = consume_stream(response)
+            if verbose:
+                print(f"✅ 分析完成!")
+                print(f"📄 结果: {description[:100]}...")
             
             return (description,)
             
@@ -203,13 +165,13 @@ class QwenVisionNode:
             return (error_msg,)
 
 if OPENAI_AVAILABLE:
-NODE_CLASS_MAPPINGS = {
-    "ModelScopeVisionNode": ModelScopeVisionNode
-}
- 
-NODE_DISPLAY_NAME_MAPPINGS = {
-    "ModelScopeVisionNode": "ModelScope-Vision 图生文节点"
-}
+    NODE_CLASS_MAPPINGS = {
+        "ModelScopeVisionNode": QwenVisionNode
+    }
+
+    NODE_DISPLAY_NAME_MAPPINGS = {
+        "ModelScopeVisionNode": "ModelScope-Vision 图生文节点"
+    }
 else:
     class OpenAINotInstalledNode:
         @classmethod
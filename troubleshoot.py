@@ -7,6 +7,7 @@ Qwen-Image ComfyUI 插件故障排除工具
 """
 
 import os
+import socket
 import sys
 import subprocess
 import json
@@ -25,10 +26,11 @@ def print_section(title):
 def run_command(command, description):
     """运行命令并返回结果"""
     print(f"📋 {description}")
-    print(f"💻 命令: {command}")
+    print(f"💻 命令: {' '.join(command)}")
     
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30)
+        # 直接传入参数列表，不经过shell解析
+        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
         if result.returncode == 0:
             print("✅ 成功")
             if result.stdout.strip():
@@ -51,20 +53,29 @@ def check_python_environment():
     print_section("Python环境检查")
     
     # Python版本
-    run_command("python --version", "检查Python版本")
+    print(f"🐍 Python版本: {sys.version}")
     
-    # pip版本
-    run_command("pip --version", "检查pip版本")
+    # 通过一次pip list获取所有已安装的包及pip版本
+    try:
+        output = subprocess.check_output(
+            [sys.executable, "-m", "pip", "list", "--format=json"],
+            stderr=subprocess.DEVNULL, text=True, timeout=60
+        )
+        installed = {p['name'].lower(): p['version'] for p in json.loads(output)}
+    except Exception as e:
+        print(f"❌ 获取已安装的包列表失败: {e}")
+        return
+    
+    print(f"📦 pip版本: {installed.get('pip', '未知')}")
     
     # 已安装的包
     print("\n📦 检查关键包安装状态:")
     packages = ['requests', 'pillow', 'torch', 'numpy', 'openai', 'httpx', 'socksio']
     
     for package in packages:
-        try:
-            __import__(package)
-            print(f"✅ {package}")
-        except ImportError:
+        if package in installed:
+            print(f"✅ {package} ({installed[package]})")
+        else:
             print(f"❌ {package} (未安装)")
 
 def check_files():
@@ -117,13 +128,21 @@ def check_network():
     """检查网络连接"""
     print_section("网络连接检查")
     
-    # 检查基本网络连接
-    run_command("ping -c 3 8.8.8.8", "检查基本网络连接")
+    # 直接与API服务器建立TCP连接，代替ping公共DNS
+    print("\n🔍 检查到API服务器的TCP连接...")
+    try:
+        sock = socket.create_connection(('api-inference.modelscope.cn', 443), timeout=5)
+        sock.close()
+        print("✅ TCP连接成功 (api-inference.modelscope.cn:443)")
+    except socket.timeout:
+        print("❌ TCP连接超时")
+    except OSError as e:
+        print(f"❌ TCP连接失败: {e}")
     
-    # 检查API服务器连接
+    # 检查API服务器连接，HEAD请求不下载响应体
     try:
         import requests
-        response = requests.get('https://api-inference.modelscope.cn', timeout=10)
+        response = requests.head('https://api-inference.modelscope.cn', timeout=5, allow_redirects=False)
         print(f"✅ API服务器连接正常 (状态码: {response.status_code})")
     except Exception as e:
         print(f"❌ API服务器连接失败: {e}")
@@ -142,7 +161,8 @@ def check_token():
     """检查API Token"""
     print_section("API Token检查")
     
-    token_sources = ['.qwen_token', 'config.json']
+    # 节点将token保存在modelscope_config.json中，.qwen_token为旧版本遗留文件
+    token_sources = ['modelscope_config.json', '.qwen_token']
     token_found = False
     
     for source in token_sources:
@@ -158,7 +178,7 @@ def check_token():
             except Exception as e:
                 print(f"❌ 读取 {source} 失败: {e}")
         
-        elif source == 'config.json':
+        elif source == 'modelscope_config.json':
             try:
                 with open(source, 'r', encoding='utf-8') as f:
                     config = json.load(f)
@@ -179,17 +199,17 @@ def run_diagnostic_tests():
     print_section("诊断测试")
     
     tests = [
-        ("python verify_installation.py", "运行安装验证"),
-        ("python test_vision_with_proxy.py", "运行代理测试"),
+        ("verify_installation.py", "运行安装验证"),
+        ("test_vision_with_proxy.py", "运行代理测试"),
     ]
     
-    for command, description in tests:
-        if os.path.exists(command.split()[1]):
-            success, output = run_command(command, description)
+    for script, description in tests:
+        if os.path.exists(script):
+            success, output = run_command([sys.executable, script], description)
             if not success:
                 print(f"⚠️ {description} 失败，请查看详细输出")
         else:
-            print(f"⚪ {command.split()[1]} 不存在，跳过测试")
+            print(f"⚪ {script} 不存在，跳过测试")
 
 def suggest_solutions():
     """建议解决方案"""
@@ -3,6 +3,7 @@
 
 import os
 import sys
+import importlib.util
 
 def check_files():
     required_files = [
@@ -31,22 +32,21 @@ def check_dependencies():
     print("\n📦 检查依赖包...")
     
     deps = {
-        'requests': '网络请求',
+        'httpx': '网络请求（所有节点）',
         'PIL': '图像处理',
         'torch': '深度学习框架',
         'numpy': '数值计算',
         'openai': '文本生成和图生文功能',
-        'httpx': '高级HTTP客户端',
         'socksio': 'SOCKS代理支持'
     }
     
     missing_deps = []
     
+    # 只查找模块位置而不实际导入，避免加载torch等大型库
     for dep, desc in deps.items():
-        try:
-            __import__(dep)
+        if importlib.util.find_spec(dep) is not None:
             print(f"✅ {dep} ({desc})")
-        except ImportError:
+        else:
             print(f"❌ {dep} ({desc}) - 未安装")
             missing_deps.append(dep)
     
@@ -55,19 +55,15 @@ def check_dependencies():
 def check_proxy_support():
     print("\n🌐 检查代理支持...")
     
-    try:
-        import httpx
-        try:
-            import socksio
-            print("✅ SOCKS代理支持已安装")
-            return True
-        except ImportError:
-            print("⚠️ SOCKS代理支持未安装，如果使用代理可能会出错")
-            print("   建议运行: pip install httpx[socks] socksio")
-            return False
-    except ImportError:
+    if importlib.util.find_spec('httpx') is None:
         print("❌ httpx未安装")
         return False
+    if importlib.util.find_spec('socksio') is not None:
+        print("✅ SOCKS代理支持已安装")
+        return True
+    print("⚠️ SOCKS代理支持未安装，如果使用代理可能会出错")
+    print("   建议运行: pip install httpx[socks] socksio")
+    return False
 
 def check_node_loading():
     print("\n🔧 检查节点加载...")
@@ -165,7 +161,7 @@ def main():
         print("或手动安装:")
         for dep in missing_deps:
             if dep == 'httpx':
-                print(f"  pip install httpx[socks]")
+                print(f"  pip install httpx[socks,http2]")
             else:
                 print(f"  pip install {dep}")
     